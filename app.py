@@ -5,19 +5,27 @@
 # ajuste do tamanho da fonte para que os valores de KPI não sejam cortados.
 #
 # Para rodar:
-# 1) Instale as dependências: `pip install streamlit pandas numpy plotly openpyxl python-date-util xlsxwriter`
+# 1) Instale as dependências: `pip install streamlit pandas numpy plotly openpyxl python-calamine pyarrow tsdownsample babel python-date-util xlsxwriter`
 # 2) Rode o aplicativo: `streamlit run app.py`
 #
 # Autor: Gemini (Versão final aprimorada)
 # Data: 28/08/2025
 
 import os
+import re
+import hashlib
+import pathlib
+import functools
+import math
+import unicodedata
 import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
 from datetime import date
 from io import BytesIO
+from babel.numbers import format_currency
+from openpyxl import load_workbook
 
 # --------------------- 1. PÁGINA DE CONFIGURAÇÃO ---------------------
 st.set_page_config(
@@ -27,10 +35,145 @@ st.set_page_config(
 )
 
 # --------------------- 2. FUNÇÕES ÚTEIS ---------------------
-@st.cache_data
-def load_and_prepare_data(file_path):
+CACHE_DIR = ".cache"
+# Versão do formato do DataFrame salvo em `.cache/`. Incremente sempre que o
+# pré-processamento de `load_and_prepare_data` mudar, para invalidar caches antigos.
+CACHE_VERSION = 6
+
+# Siglas das UFs usadas no mapa; endereços sem UF reconhecida ficam como 'Outro'
+STATE_CODES = {
+    'AC': 'AC', 'AL': 'AL', 'AP': 'AP', 'AM': 'AM', 'BA': 'BA', 'CE': 'CE', 'DF': 'DF', 'ES': 'ES', 
+    'GO': 'GO', 'MA': 'MA', 'MT': 'MT', 'MS': 'MS', 'MG': 'MG', 'PA': 'PA', 'PB': 'PB', 'PR': 'PR', 
+    'PE': 'PE', 'PI': 'PI', 'RJ': 'RJ', 'RN': 'RN', 'RS': 'RS', 'RO': 'RO', 'RR': 'RR', 'SC': 'SC', 
+    'SP': 'SP', 'SE': 'SE', 'TO': 'TO', 'Outro': 'Outro'
+}
+
+# Colunas de valores monetários
+MONEY_COLS = ["Salario_Base", "Impostos", "Beneficios", "VT", "VR"]
+
+_PUNCT_RE = re.compile(r'[^a-zA-Z0-9_]')
+
+def normalize_column_name(name):
+    """
+    Remove acentos, troca espaços por '_' e descarta caracteres especiais do nome da coluna.
+    """
+    ascii_name = unicodedata.normalize('NFKD', str(name)).encode('ascii', 'ignore').decode('utf-8')
+    return _PUNCT_RE.sub('', ascii_name.replace(' ', '_'))
+
+def file_cache_key(file_path):
+    """
+    Gera a chave do cache em disco a partir do conteúdo do arquivo e da versão do
+    pré-processamento, de modo que cópias ou restaurações do mesmo arquivo reaproveitem o cache.
+    """
+    digest = hashlib.blake2b(pathlib.Path(file_path).read_bytes(), digest_size=16)
+    digest.update(f"v{CACHE_VERSION}".encode())
+    return digest.hexdigest()
+
+def prune_parquet_cache(keep):
+    """
+    Remove os arquivos Parquet antigos de `.cache/` (de dias ou versões anteriores),
+    mantendo apenas `keep`.
+    """
+    for path in pathlib.Path(CACHE_DIR).glob("*.parquet"):
+        if path != pathlib.Path(keep):
+            path.unlink(missing_ok=True)
+
+def read_excel_fast(file_path):
+    """
+    Lê o arquivo Excel com o motor calamine (muito mais rápido) e,
+    caso ele não esteja instalado, recorre ao openpyxl.
+    """
+    try:
+        return pd.read_excel(file_path, engine="calamine")
+    except (ImportError, ValueError):
+        return read_excel_openpyxl(file_path)
+
+def read_excel_openpyxl(file_path):
+    """
+    Lê a primeira planilha com openpyxl em modo somente leitura, iterando apenas os valores.
+    Bem mais rápido que o caminho padrão do pandas com openpyxl em planilhas grandes.
+    """
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame()
+        df = pd.DataFrame(rows, columns=header)
+    finally:
+        wb.close()
+    # No modo somente leitura, linhas vazias no fim da planilha podem vir como None
+    return df.dropna(how="all")
+
+def data_fingerprint(file_path):
+    """
+    Identifica a versão do arquivo de dados pela data de modificação e pelo tamanho, sem lê-lo.
+    Retorna None se o arquivo não existir.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def prepare_excel(file_path):
+    """
+    Lê o arquivo Excel e aplica o pré-processamento que não depende da data atual
+    (é o que fica salvo no cache em disco).
+    """
+    df = read_excel_fast(file_path)
+    
+    # Normaliza os nomes das colunas, removendo acentos, espaços e caracteres especiais
+    df.columns = [normalize_column_name(c) for c in df.columns]
+
+    # Trata colunas de data
+    date_cols = ["Data_de_Nascimento", "Data_de_Contratacao", "Data_de_Demissao"]
+    for col in date_cols:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+
+    # Valores monetários ficam em float64: float32 não representa os centavos com exatidão
+    for col in MONEY_COLS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+    
+    # Cria colunas de dados derivados
+    if "Data_de_Demissao" in df.columns:
+        df["Status"] = np.where(df["Data_de_Demissao"].notna(), "Desligado", "Ativo")
+    else:
+        df["Status"] = "Ativo"
+    
+    if "Sexo" in df.columns:
+        df["Sexo"] = df["Sexo"].astype(str).str.upper().str.strip()
+        # Garante que os valores sejam 'M' ou 'F'
+        df["Sexo"] = df["Sexo"].where(df["Sexo"].isin(["M", "F"]), other=np.nan)
+
+    # Custo mensal por funcionário (salário + encargos + benefícios)
+    custo_cols = [c for c in MONEY_COLS if c in df.columns]
+    if custo_cols:
+        df["Custo_Total_Mensal"] = df[custo_cols].sum(axis=1)
+
+    # Extrai a UF do final do endereço (ex.: "... Salvador - BA, 40155-150") uma única vez por arquivo.
+    # Após a normalização dos nomes, a coluna "Endereço" da planilha se chama "Endereco".
+    if "Endereco" in df.columns:
+        estado = df["Endereco"].str.extract(r'\s-\s([A-Z]{2})(?:,\s*\d{5}-?\d{3})?\s*$', expand=False)
+        estado = estado.where(estado.isin(list(STATE_CODES)), "Outro")
+        df["Estado"] = estado.astype(pd.CategoricalDtype(list(STATE_CODES)))
+
+    # Colunas de baixa cardinalidade viram `category`: filtros e agrupamentos ficam mais rápidos
+    for col in ["Area", "Nivel", "Cargo", "Status", "Sexo"]:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+
+    return df
+
+@st.cache_data(max_entries=2)
+def load_and_prepare_data(file_path, data_version, today):
     """
     Carrega dados de um arquivo Excel e realiza o pré-processamento.
+    O resultado é salvo em Parquet em `.cache/`, evitando reprocessar o Excel.
+    `data_version` (ver `data_fingerprint`) e `today` só entram na chave do cache, para
+    recarregar quando o arquivo muda e recalcular a "Idade" quando o dia muda.
     Retorna o DataFrame preparado e um booleano de sucesso.
     """
     if not os.path.exists(file_path):
@@ -38,46 +181,51 @@ def load_and_prepare_data(file_path):
         st.info("Por favor, certifique-se de que o arquivo 'BaseFuncionarios.xlsx' esteja na mesma pasta do 'app.py'.")
         return pd.DataFrame(), False
 
-    try:
-        df = pd.read_excel(file_path, engine="openpyxl")
-        
-        # Normaliza os nomes das colunas, removendo acentos, espaços e caracteres especiais
-        df.columns = df.columns.str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('utf-8').str.replace(' ', '_').str.replace('[^a-zA-Z0-9_]', '', regex=True)
-
-        # Trata colunas de data
-        date_cols = ["Data_de_Nascimento", "Data_de_Contratacao", "Data_de_Demissao"]
-        for col in date_cols:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors="coerce")
-        
-        # Cria colunas de dados derivados
-        today = pd.Timestamp(date.today())
-        if "Data_de_Nascimento" in df.columns:
-            df["Idade"] = ((today - df["Data_de_Nascimento"]).dt.days / 365.25).astype(int)
-        
-        if "Data_de_Demissao" in df.columns:
-            df["Status"] = np.where(df["Data_de_Demissao"].notna(), "Desligado", "Ativo")
-        else:
-            df["Status"] = "Ativo"
-        
-        if "Sexo" in df.columns:
-            df["Sexo"] = df["Sexo"].astype(str).str.upper().str.strip()
-            # Garante que os valores sejam 'M' ou 'F'
-            df["Sexo"] = df["Sexo"].apply(lambda x: 'M' if x == 'M' else 'F' if x == 'F' else np.nan)
-
-        return df, True
-
-    except Exception as e:
-        st.error(f"❌ Erro ao processar o arquivo Excel: {e}")
-        return pd.DataFrame(), False
-
+    df = None
+    cache_path = os.path.join(CACHE_DIR, f"{file_cache_key(file_path)}.parquet")
+    if os.path.exists(cache_path):
+        try:
+            df = pd.read_parquet(cache_path, engine="pyarrow")
+        except Exception:
+            pass  # Cache corrompido ou ilegível: reprocessa o Excel
+
+    if df is None:
+        try:
+            df = prepare_excel(file_path)
+        except Exception as e:
+            st.error(f"❌ Erro ao processar o arquivo Excel: {e}")
+            return pd.DataFrame(), False
+
+        # Salva o resultado em disco; falhas no cache não impedem o uso do painel
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            df.to_parquet(cache_path, engine="pyarrow", compression="zstd")
+            prune_parquet_cache(keep=cache_path)
+        except Exception:
+            pass
+
+    # A idade depende do dia atual, por isso fica fora do cache em disco
+    if "Data_de_Nascimento" in df.columns:
+        bd = df["Data_de_Nascimento"]
+        # Idade em anos completos: desconta 1 se o aniversário ainda não chegou este ano
+        birthday_pending = (today.month < bd.dt.month) | ((today.month == bd.dt.month) & (today.day < bd.dt.day))
+        idade = (today.year - bd.dt.year - birthday_pending.astype("int8")).astype("Int16")
+        df.insert(df.columns.get_loc("Status"), "Idade", idade)
+
+    return df, True
+
+@functools.lru_cache(maxsize=1024)
 def brl(x: float) -> str:
     """
     Formata um número para o padrão de moeda Real (R$), garantindo 2 casas decimais.
     """
     try:
-        # Usa um formato f-string com separador de milhares e vírgula decimal
-        return f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+        # NaN (ex.: todos os salários do recorte vazios) e infinito não são valores monetários;
+        # o babel não falha com eles, devolveria "R$ NaN,00"
+        if not math.isfinite(x):
+            return "N/A"
+        # Usa as regras de formatação do CLDR para pt_BR (separador de milhares e vírgula decimal)
+        return format_currency(x, "BRL", locale="pt_BR")
     except (ValueError, TypeError):
         return "R$ 0,00"
         
@@ -103,6 +251,162 @@ def format_kpi_value(value):
         
     return f"""<div style="font-size:{font_size}; color:{colors['main']}; font-weight:500;">{val_str}</div>"""
 
+BR_STATES_GEOJSON_URL = "https://raw.githubusercontent.com/codeforamerica/click-that-hood/master/geojson/brazil-states.geojson"
+# Cópia local servida pelo próprio Streamlit (static serving habilitado em .streamlit/config.toml)
+BR_STATES_GEOJSON_STATIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "brazil-states.geojson")
+
+def br_states_geojson_url():
+    """
+    URL do GeoJSON dos estados brasileiros para o mapa.
+    Usa a cópia em `static/`, que funciona em servidores sem internet, quando ela existe;
+    senão, o arquivo público no GitHub. Em ambos os casos é o navegador que baixa e
+    guarda o arquivo em cache, então o GeoJSON não é enviado junto com o gráfico a cada atualização.
+    """
+    if os.path.exists(BR_STATES_GEOJSON_STATIC):
+        return "app/static/brazil-states.geojson"
+    return BR_STATES_GEOJSON_URL
+
+AGG_CACHE_ENTRIES = 64
+EXPORT_CACHE_ENTRIES = 4  # Cada entrada guarda o arquivo exportado inteiro
+
+# Agregações usadas nos KPIs e gráficos. Ficam em cache chaveadas pela tupla de filtros
+# (que inclui a versão do arquivo de dados), então mudanças que não alteram os dados
+# (ex.: tema de cores) não recalculam nada. `max_entries` limita a memória usada
+# pelas combinações de filtros já vistas. Os agrupamentos usam pandas direto: com ~100 mil
+# linhas levam ~2 ms, e nem Polars nem o motor numba foram mais rápidos nessa escala.
+@st.cache_data(max_entries=AGG_CACHE_ENTRIES)
+def compute_kpis(_df_filtered, filters, today):
+    """
+    Calcula os indicadores da barra superior para o recorte filtrado.
+    """
+    kpis = {
+        "headcount_total": len(_df_filtered),
+        "headcount_ativo": int((_df_filtered["Status"] == "Ativo").sum()),
+        "novas_contratacoes": int((_df_filtered["Data_de_Contratacao"].dt.year == today.year).sum()),
+        "total_demissoes": int((_df_filtered["Status"] == "Desligado").sum()),
+        "masculino_count": int((_df_filtered.get("Sexo") == 'M').sum()),
+        "feminino_count": int((_df_filtered.get("Sexo") == 'F').sum()),
+        "folha_salarial_anual": None,
+        "salario_medio": None,
+        "idade_media": None,
+    }
+    if "Salario_Base" in _df_filtered.columns:
+        kpis["folha_salarial_anual"] = _df_filtered["Salario_Base"].sum() * 12
+        if len(_df_filtered) > 0:
+            kpis["salario_medio"] = _df_filtered["Salario_Base"].mean()
+    if "Idade" in _df_filtered.columns and len(_df_filtered) > 0:
+        kpis["idade_media"] = _df_filtered["Idade"].mean()
+    return kpis
+
+def lttb_downsample(df_wide, n_out):
+    """
+    Reduz uma série temporal larga (uma coluna por série) para no máximo `n_out` pontos com LTTB.
+    Cada série recebe uma cota de `n_out // número de colunas` pontos e os pontos escolhidos
+    são unidos, mantendo o mesmo eixo X para todas.
+    Sem o pacote `tsdownsample`, devolve o DataFrame original.
+    """
+    if len(df_wide) <= n_out:
+        return df_wide
+    try:
+        from tsdownsample import LTTBDownsampler
+    except ImportError:
+        return df_wide
+
+    downsampler = LTTBDownsampler()
+    n_per_series = max(n_out // len(df_wide.columns), 3)  # LTTB precisa de pelo menos 3 pontos
+    keep = set()
+    for col in df_wide.columns:
+        keep.update(downsampler.downsample(df_wide[col].to_numpy(dtype="float64"), n_out=n_per_series).tolist())
+    return df_wide.iloc[sorted(keep)]
+
+@st.cache_data(max_entries=AGG_CACHE_ENTRIES)
+def monthly_hire_fire(_df_filtered, filters, n_out=500):
+    """
+    Contagem mensal de admissões e demissões, em formato longo para o gráfico de área.
+    Históricos longos são reduzidos a ~`n_out` meses antes de ir para o navegador.
+    """
+    status = _df_filtered["Status"]
+    adm = _df_filtered.loc[status == "Ativo", "Data_de_Contratacao"].dropna().dt.to_period('M').value_counts().sort_index()
+    dem = _df_filtered.loc[status == "Desligado", "Data_de_Demissao"].dropna().dt.to_period('M').value_counts().sort_index()
+
+    df_line = pd.concat({"Admissões": adm, "Demissões": dem}, axis=1).sort_index().fillna(0)
+    df_line = lttb_downsample(df_line, n_out)
+    df_line.index = df_line.index.astype(str)
+    return df_line.reset_index(names="Mes").melt("Mes", var_name="Tipo", value_name="Contagem")
+
+@st.cache_data(max_entries=AGG_CACHE_ENTRIES)
+def sex_counts(_df_filtered, filters):
+    """
+    Contagem de funcionários por sexo.
+    """
+    counts = _df_filtered["Sexo"].value_counts().reset_index()
+    counts.columns = ["Sexo", "Contagem"]
+    return counts[counts["Contagem"] > 0]
+
+@st.cache_data(max_entries=AGG_CACHE_ENTRIES)
+def age_brackets(_df_filtered, filters):
+    """
+    Contagem de funcionários por faixa etária.
+    """
+    edges = np.array([0, 18, 25, 35, 45, 55, 65, 100])
+    labels = np.array(['0-18', '19-25', '26-35', '36-45', '46-55', '56-65', '65+'])
+    idades = _df_filtered["Idade"].dropna().to_numpy(dtype="int64")
+    # Faixas fechadas à esquerda, como em pd.cut(..., right=False); extremos vão para a primeira/última faixa
+    idx = np.clip(np.searchsorted(edges, idades, side='right') - 1, 0, len(labels) - 1)
+    return pd.DataFrame({"Faixa_Etaria": labels, "Contagem": np.bincount(idx, minlength=len(labels))})
+
+@st.cache_data(max_entries=AGG_CACHE_ENTRIES)
+def top_cargos(_df_filtered, filters, n=10):
+    """
+    Os `n` cargos com maior número de funcionários.
+    """
+    cargo_counts = _df_filtered["Cargo"].value_counts().reset_index()
+    cargo_counts.columns = ["Cargo", "Contagem"]
+    cargo_counts = cargo_counts[cargo_counts["Contagem"] > 0]
+    return cargo_counts.sort_values(by="Contagem", ascending=False).head(n)
+
+@st.cache_data(max_entries=AGG_CACHE_ENTRIES)
+def salary_by_cargo(_df_filtered, filters, n=10):
+    """
+    Os `n` cargos com maior salário base médio.
+    """
+    salarios = _df_filtered.groupby("Cargo", observed=True)["Salario_Base"].mean().reset_index()
+    return salarios.sort_values(by="Salario_Base", ascending=False).head(n)
+
+@st.cache_data(max_entries=AGG_CACHE_ENTRIES)
+def sunburst_frame(_df_filtered, filters):
+    """
+    Custo total mensal agregado por Nível e Área, pronto para o gráfico sunburst.
+    """
+    grouped = _df_filtered["Custo_Total_Mensal"].groupby([_df_filtered["Nivel"], _df_filtered["Area"]], observed=True)
+    return grouped.sum().reset_index()
+
+@st.cache_data(max_entries=AGG_CACHE_ENTRIES)
+def estado_counts(_df_filtered, filters):
+    """
+    Contagem de funcionários por estado (UF).
+    """
+    counts = _df_filtered["Estado"].value_counts().reset_index()
+    counts.columns = ["Estado", "Contagem"]
+    return counts[counts["Contagem"] > 0]
+
+@st.cache_data(max_entries=EXPORT_CACHE_ENTRIES)
+def to_csv_bytes(_df_filtered, filters):
+    """
+    Exporta o recorte filtrado para CSV (bytes em UTF-8).
+    """
+    return _df_filtered.to_csv(index=False).encode("utf-8")
+
+@st.cache_data(max_entries=EXPORT_CACHE_ENTRIES)
+def to_xlsx_bytes(_df_filtered, filters):
+    """
+    Exporta o recorte filtrado para um arquivo Excel em memória.
+    """
+    excel_buffer = BytesIO()
+    with pd.ExcelWriter(excel_buffer, engine="xlsxwriter") as writer:
+        _df_filtered.to_excel(writer, index=False, sheet_name="Dados Filtrados")
+    return excel_buffer.getvalue()
+
 # --------------------- 3. PALETAS DE CORES ---------------------
 # Define as paletas de cores para os gráficos
 color_palettes = {
@@ -129,12 +433,14 @@ st.title("People Analytics | Quadro de Colaboradores")
 st.markdown("Uma visão completa e interativa sobre a força de trabalho.")
 
 # Carrega os dados
-df, success = load_and_prepare_data("BaseFuncionarios.xlsx")
+DATA_FILE = "BaseFuncionarios.xlsx"
+data_version = data_fingerprint(DATA_FILE)
+# Data de hoje, usada na idade e nos KPIs
+today = pd.Timestamp(date.today())
+df, success = load_and_prepare_data(DATA_FILE, data_version, today)
 if not success or df.empty:
     st.stop()
-    
-# Define a variável `today` para ser usada nos KPIs
-today = pd.Timestamp(date.today())
+
 
 # --------------------- 5. BARRA LATERAL (FILTROS) ---------------------
 st.sidebar.header("⚙️ Opções de Filtro")
@@ -143,52 +449,70 @@ st.sidebar.header("⚙️ Opções de Filtro")
 selected_theme = st.sidebar.radio("🎨 Tema de Cores", ("Azul", "Vermelho"))
 colors = color_palettes[selected_theme]
 
+# Modo de renderização dos gráficos de série temporal: WebGL escala melhor com muitos pontos,
+# SVG é mais leve para máquinas sem aceleração gráfica
+render_mode = st.sidebar.radio(
+    "🖥️ Renderização dos Gráficos",
+    ("WebGL", "SVG"),
+    help="Use SVG caso os gráficos não apareçam corretamente (ex.: máquinas virtuais sem GPU)."
+)
+
 # Filtros de dados
 st.sidebar.markdown("---")
 st.sidebar.subheader("Filtros Específicos")
 
-df_filtered = df.copy()
+selected_area = selected_nivel = selected_cargo = selected_status = "Todos"
+sal_range = None
+
+# Os filtros são acumulados em uma única máscara booleana e o DataFrame é fatiado uma só vez
+mask = np.ones(len(df), dtype=bool)
 
 # Filtro de Área
 if "Area" in df.columns:
     areas = ["Todos"] + df["Area"].unique().tolist()
     selected_area = st.sidebar.selectbox("Área", areas)
     if selected_area != "Todos":
-        df_filtered = df_filtered[df_filtered["Area"] == selected_area]
+        mask &= (df["Area"].values == selected_area)
 
 # Filtro de Nível
-if "Nivel" in df_filtered.columns:
-    niveis = ["Todos"] + df_filtered["Nivel"].unique().tolist()
+if "Nivel" in df.columns:
+    niveis = ["Todos"] + df.loc[mask, "Nivel"].unique().tolist()
     selected_nivel = st.sidebar.selectbox("Nível", niveis)
     if selected_nivel != "Todos":
-        df_filtered = df_filtered[df_filtered["Nivel"] == selected_nivel]
+        mask &= (df["Nivel"].values == selected_nivel)
 
 # Filtro de Cargo
-if "Cargo" in df_filtered.columns:
-    cargos = ["Todos"] + df_filtered["Cargo"].unique().tolist()
+if "Cargo" in df.columns:
+    cargos = ["Todos"] + df.loc[mask, "Cargo"].unique().tolist()
     selected_cargo = st.sidebar.selectbox("Cargo", cargos)
     if selected_cargo != "Todos":
-        df_filtered = df_filtered[df_filtered["Cargo"] == selected_cargo]
+        mask &= (df["Cargo"].values == selected_cargo)
 
 # Filtro de Salário
-if "Salario_Base" in df_filtered.columns and not df_filtered["Salario_Base"].dropna().empty:
-    min_sal = int(df_filtered["Salario_Base"].min())
-    max_sal = int(df_filtered["Salario_Base"].max())
+if "Salario_Base" in df.columns and not df.loc[mask, "Salario_Base"].dropna().empty:
+    sal = df["Salario_Base"]
+    min_sal = int(sal[mask].min())
+    max_sal = int(sal[mask].max())
     sal_range = st.sidebar.slider("Faixa Salarial (R$)", min_sal, max_sal, (min_sal, max_sal))
-    df_filtered = df_filtered[(df_filtered["Salario_Base"] >= sal_range[0]) & (df_filtered["Salario_Base"] <= sal_range[1])]
+    mask &= (sal.values >= sal_range[0]) & (sal.values <= sal_range[1])
 
 # Filtro de Status
-if "Status" in df_filtered.columns:
-    status_options = ["Todos"] + df_filtered["Status"].unique().tolist()
+if "Status" in df.columns:
+    status_options = ["Todos"] + df.loc[mask, "Status"].unique().tolist()
     selected_status = st.sidebar.selectbox("Status do Funcionário", status_options)
     if selected_status != "Todos":
-        df_filtered = df_filtered[df_filtered["Status"] == selected_status]
+        mask &= (df["Status"].values == selected_status)
 
 # Adiciona um filtro geral para "Nome Completo"
 st.sidebar.markdown("---")
 search_query = st.sidebar.text_input("🔎 Pesquisar por Nome", help="Busque por um nome específico.")
 if search_query:
-    df_filtered = df_filtered[df_filtered["Nome_Completo"].str.contains(search_query, case=False, na=False)]
+    mask &= df["Nome_Completo"].str.contains(search_query, case=False, na=False, regex=False).values
+
+df_filtered = df[mask]
+
+# Chave das agregações em cache: muda apenas quando algum filtro ou o arquivo de dados muda
+filters = (data_version, selected_area, selected_nivel, selected_cargo, sal_range, selected_status, search_query)
 
 # --------------------- 6. ESTILOS CSS PERSONALIZADOS ---------------------
 st.markdown(f"""
@@ -248,31 +572,29 @@ st.markdown(f"""
 st.subheader("Métricas de Visão Geral")
 
 # Cálculo de KPIs
-headcount_total = len(df_filtered)
-headcount_ativo = len(df_filtered[df_filtered["Status"] == "Ativo"])
-novas_contratacoes = len(df_filtered[df_filtered["Data_de_Contratacao"].dt.year == today.year])
-total_demissoes = len(df_filtered[df_filtered["Status"] == "Desligado"])
-masculino_count = len(df_filtered[df_filtered.get("Sexo") == 'M'])
-feminino_count = len(df_filtered[df_filtered.get("Sexo") == 'F'])
+kpis = compute_kpis(df_filtered, filters, today)
+headcount_total = kpis["headcount_total"]
+headcount_ativo = kpis["headcount_ativo"]
+novas_contratacoes = kpis["novas_contratacoes"]
+total_demissoes = kpis["total_demissoes"]
+masculino_count = kpis["masculino_count"]
+feminino_count = kpis["feminino_count"]
 
 # Folha salarial anual
-if "Salario_Base" in df_filtered.columns:
-    folha_salarial_anual = df_filtered["Salario_Base"].sum() * 12
-    folha_salarial_anual_fmt = brl(folha_salarial_anual)
+if kpis["folha_salarial_anual"] is not None:
+    folha_salarial_anual_fmt = brl(kpis["folha_salarial_anual"])
 else:
     folha_salarial_anual_fmt = "N/A"
 
 # Salário médio
-if "Salario_Base" in df_filtered.columns and headcount_total > 0:
-    salario_medio = df_filtered["Salario_Base"].mean()
-    salario_medio_fmt = brl(salario_medio)
+if kpis["salario_medio"] is not None:
+    salario_medio_fmt = brl(kpis["salario_medio"])
 else:
     salario_medio_fmt = "N/A"
 
 # Idade média
-if "Idade" in df_filtered.columns and headcount_total > 0:
-    idade_media = df_filtered["Idade"].mean()
-    idade_media_fmt = f"{idade_media:.1f} anos"
+if kpis["idade_media"] is not None:
+    idade_media_fmt = f"{kpis['idade_media']:.1f} anos"
 else:
     idade_media_fmt = "N/A"
 
@@ -310,28 +632,28 @@ with row1_col1:
         st.markdown("<div class='chart-card'>", unsafe_allow_html=True)
         st.subheader("Contratações e Demissões (Mensal)")
         if "Data_de_Contratacao" in df_filtered.columns and "Data_de_Demissao" in df_filtered.columns:
-            df_admissao = df_filtered[df_filtered['Status'] == 'Ativo'].copy()
-            df_demissao = df_filtered[df_filtered['Status'] == 'Desligado'].copy()
-
-            df_admissao["Mes"] = df_admissao["Data_de_Contratacao"].dt.to_period('M').astype(str)
-            df_demissao["Mes"] = df_demissao["Data_de_Demissao"].dt.to_period('M').astype(str)
-
-            admissao_counts = df_admissao.groupby("Mes").size().reset_index(name="Admissões")
-            demissao_counts = df_demissao.groupby("Mes").size().reset_index(name="Demissões")
-
-            df_line = pd.merge(admissao_counts, demissao_counts, on="Mes", how="outer").fillna(0)
-            df_line_long = pd.melt(df_line, id_vars="Mes", var_name="Tipo", value_name="Contagem")
+            df_line_long = monthly_hire_fire(df_filtered, filters)
             
-            fig_line = px.area(
-                df_line_long, 
+            line_args = dict(
                 x="Mes", 
-                y="Contagem", 
                 color="Tipo",
                 title="Tendência de Contratações vs. Demissões por Mês",
                 color_discrete_map={"Admissões": colors["main"], "Demissões": colors["neutral"]}
             )
+            if render_mode == "WebGL":
+                # px.area não aceita render_mode; usa linhas WebGL (Scattergl) empilhadas como no px.area:
+                # cada série é desenhada sobre a soma acumulada das anteriores e preenchida até a de baixo
+                df_stacked = df_line_long.assign(Empilhado=df_line_long.groupby("Mes", sort=False)["Contagem"].cumsum())
+                fig_line = px.line(
+                    df_stacked, y="Empilhado", render_mode="webgl",
+                    hover_data={"Contagem": True, "Empilhado": False}, **line_args
+                )
+                fig_line.update_traces(fill="tonexty")
+                fig_line.data[0].fill = "tozeroy"
+            else:
+                fig_line = px.area(df_line_long, y="Contagem", **line_args)
             fig_line.update_layout(xaxis_title="", yaxis_title="Número de Pessoas")
-            st.plotly_chart(fig_line, use_container_width=True)
+            st.plotly_chart(fig_line, use_container_width=True, key="fig_line")
         st.markdown("</div>", unsafe_allow_html=True)
 
 with row1_col2:
@@ -342,34 +664,27 @@ with row1_col2:
         
         with col_demog1:
             if "Sexo" in df_filtered.columns:
-                sex_counts = df_filtered.get("Sexo").value_counts().reset_index()
-                sex_counts.columns = ["Sexo", "Contagem"]
                 fig_sex = px.pie(
-                    sex_counts,
+                    sex_counts(df_filtered, filters),
                     values="Contagem",
                     names="Sexo",
                     title="Distribuição por Sexo",
                     color_discrete_sequence=colors["pie_gender"]
                 )
                 fig_sex.update_traces(textposition='inside', textinfo='percent+label')
-                st.plotly_chart(fig_sex, use_container_width=True)
+                st.plotly_chart(fig_sex, use_container_width=True, key="fig_sex")
 
         with col_demog2:
             if "Idade" in df_filtered.columns:
-                bins = [0, 18, 25, 35, 45, 55, 65, 100]
-                labels = ['0-18', '19-25', '26-35', '36-45', '46-55', '56-65', '65+']
-                df_filtered["Faixa_Etaria"] = pd.cut(df_filtered["Idade"], bins=bins, labels=labels, right=False)
-                age_counts = df_filtered["Faixa_Etaria"].value_counts().reset_index()
-                age_counts.columns = ["Faixa_Etaria", "Contagem"]
                 fig_age = px.bar(
-                    age_counts.sort_values(by="Faixa_Etaria"),
+                    age_brackets(df_filtered, filters),
                     x="Faixa_Etaria",
                     y="Contagem",
                     title="Distribuição por Faixa Etária",
                     color="Faixa_Etaria",
                     color_discrete_sequence=colors["sequential"]
                 )
-                st.plotly_chart(fig_age, use_container_width=True)
+                st.plotly_chart(fig_age, use_container_width=True, key="fig_age")
         st.markdown("</div>", unsafe_allow_html=True)
 
 with row2_col1:
@@ -377,10 +692,8 @@ with row2_col1:
         st.markdown("<div class='chart-card'>", unsafe_allow_html=True)
         st.subheader("Nível Hierárquico")
         if "Cargo" in df_filtered.columns:
-            cargo_counts = df_filtered["Cargo"].value_counts().reset_index()
-            cargo_counts.columns = ["Cargo", "Contagem"]
             fig_cargo = px.bar(
-                cargo_counts.sort_values(by="Contagem", ascending=False).head(10),
+                top_cargos(df_filtered, filters),
                 x="Cargo",
                 y="Contagem",
                 title="Top 10 Cargos por Headcount",
@@ -388,7 +701,7 @@ with row2_col1:
                 color_discrete_sequence=colors["sequential"]
             )
             fig_cargo.update_layout(xaxis={'categoryorder':'total descending'})
-            st.plotly_chart(fig_cargo, use_container_width=True)
+            st.plotly_chart(fig_cargo, use_container_width=True, key="fig_cargo")
         st.markdown("</div>", unsafe_allow_html=True)
 
 with row2_col2:
@@ -396,9 +709,8 @@ with row2_col2:
         st.markdown("<div class='chart-card'>", unsafe_allow_html=True)
         st.subheader("Salário Médio por Cargo")
         if "Cargo" in df_filtered.columns and "Salario_Base" in df_filtered.columns:
-            salary_by_cargo = df_filtered.groupby("Cargo")["Salario_Base"].mean().reset_index()
             fig_sal_cargo = px.bar(
-                salary_by_cargo.sort_values(by="Salario_Base", ascending=False).head(10),
+                salary_by_cargo(df_filtered, filters),
                 x="Salario_Base",
                 y="Cargo",
                 orientation='h',
@@ -407,51 +719,35 @@ with row2_col2:
                 color_discrete_sequence=colors["sequential"]
             )
             fig_sal_cargo.update_layout(yaxis={'categoryorder':'total ascending'})
-            st.plotly_chart(fig_sal_cargo, use_container_width=True)
+            st.plotly_chart(fig_sal_cargo, use_container_width=True, key="fig_sal_cargo")
         st.markdown("</div>", unsafe_allow_html=True)
 
 with row3_col1:
     with st.container(border=True):
         st.markdown("<div class='chart-card'>", unsafe_allow_html=True)
         st.subheader("Custo por Nível e Área")
-        if "Custo_Total_Mensal" not in df_filtered.columns:
-            custo_cols = [c for c in ["Salario_Base", "Impostos", "Beneficios", "VT", "VR"] if c in df_filtered.columns]
-            df_filtered["Custo_Total_Mensal"] = df_filtered[custo_cols].sum(axis=1)
-
         if "Nivel" in df_filtered.columns and "Custo_Total_Mensal" in df_filtered.columns:
             fig_sunburst = px.sunburst(
-                df_filtered, 
+                sunburst_frame(df_filtered, filters),
                 path=['Nivel', 'Area'],
                 values='Custo_Total_Mensal',
                 color_discrete_sequence=colors["sequential"]
             )
             fig_sunburst.update_layout(title_text="Custo por Nível e Área", margin=dict(t=0, b=0, l=0, r=0))
-            st.plotly_chart(fig_sunburst, use_container_width=True)
+            st.plotly_chart(fig_sunburst, use_container_width=True, key="fig_sunburst")
         st.markdown("</div>", unsafe_allow_html=True)
 
 with row3_col2:
     with st.container(border=True):
         st.markdown("<div class='chart-card'>", unsafe_allow_html=True)
         st.subheader("Mapa de Contratações por Estado")
-        if "Endereço" in df_filtered.columns:
-            df_filtered["Estado"] = df_filtered["Endereço"].str.extract(r'-\s(..),?$', expand=False)
-            df_filtered["Estado"] = df_filtered["Estado"].fillna("Outro")
-            
-            estado_counts = df_filtered["Estado"].value_counts().reset_index()
-            estado_counts.columns = ["Estado", "Contagem"]
-
-            state_codes = {
-                'AC': 'AC', 'AL': 'AL', 'AP': 'AP', 'AM': 'AM', 'BA': 'BA', 'CE': 'CE', 'DF': 'DF', 'ES': 'ES', 
-                'GO': 'GO', 'MA': 'MA', 'MT': 'MT', 'MS': 'MS', 'MG': 'MG', 'PA': 'PA', 'PB': 'PB', 'PR': 'PR', 
-                'PE': 'PE', 'PI': 'PI', 'RJ': 'RJ', 'RN': 'RN', 'RS': 'RS', 'RO': 'RO', 'RR': 'RR', 'SC': 'SC', 
-                'SP': 'SP', 'SE': 'SE', 'TO': 'TO', 'Outro': 'Outro'
-            }
-            
-            estado_counts["iso_code"] = estado_counts["Estado"].map(state_codes)
+        if "Estado" in df_filtered.columns:
+            df_estado = estado_counts(df_filtered, filters)
+            df_estado["iso_code"] = df_estado["Estado"].map(STATE_CODES)
             
             fig_map = px.choropleth(
-                estado_counts,
-                geojson="https://raw.githubusercontent.com/codeforamerica/click-that-hood/master/geojson/brazil-states.geojson",
+                df_estado,
+                geojson=br_states_geojson_url(),
                 locations="iso_code",
                 featureidkey="properties.sigla",
                 color="Contagem",
@@ -460,7 +756,7 @@ with row3_col2:
                 title="Contratações por Estado"
             )
             fig_map.update_geos(fitbounds="locations", visible=False)
-            st.plotly_chart(fig_map, use_container_width=True)
+            st.plotly_chart(fig_map, use_container_width=True, key="fig_map")
         st.markdown("</div>", unsafe_allow_html=True)
 
 st.markdown("---")
@@ -469,33 +765,28 @@ st.markdown("---")
 st.subheader("Tabela de Dados e Download")
 with st.expander("Clique para visualizar a tabela completa de funcionários"):
     if not df_filtered.empty:
-        df_display = df_filtered.drop(columns=["Estado", "Faixa_Etaria", "Custo_Total_Mensal"], errors='ignore')
-        st.dataframe(df_display, use_container_width=True)
+        # Oculta colunas derivadas via `column_order`, sem copiar o DataFrame
+        display_cols = [c for c in df_filtered.columns if c not in {"Estado", "Faixa_Etaria", "Custo_Total_Mensal"}]
+        st.dataframe(df_filtered, use_container_width=True, column_order=display_cols, hide_index=True)
     else:
         st.warning("⚠️ Nenhum dado encontrado com os filtros selecionados.")
 
 col_dl1, col_dl2 = st.columns(2)
 if not df_filtered.empty:
-    csv_bytes = df_filtered.to_csv(index=False).encode("utf-8")
+    # Os arquivos só são gerados quando o usuário clica em baixar (dados passados como função)
     col_dl1.download_button(
         label="📥 Baixar CSV Filtrado",
-        data=csv_bytes,
+        data=functools.partial(to_csv_bytes, df_filtered, filters),
         file_name="funcionarios_filtrado.csv",
         mime="text/csv",
+        on_click="ignore",
+        use_container_width=True
+    )
+    col_dl2.download_button(
+        label="📥 Baixar Excel Filtrado",
+        data=functools.partial(to_xlsx_bytes, df_filtered, filters),
+        file_name="funcionarios_filtrado.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        on_click="ignore",
         use_container_width=True
     )
-    
-from io import BytesIO
-import xlsxwriter
-
-excel_buffer = BytesIO()
-with pd.ExcelWriter(excel_buffer, engine="xlsxwriter") as writer:
-    df_filtered.to_excel(writer, index=False, sheet_name="Dados Filtrados")
-
-col_dl2.download_button(
-    label="📥 Baixar Excel Filtrado",
-    data=excel_buffer.getvalue(),
-    file_name="funcionarios_filtrado.xlsx",
-    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    use_container_width=True
-)